@@ -10,15 +10,30 @@ as safe (auto-approve) or potentially dangerous (ask user). The LLM assessment
 provides context-aware safety decisions beyond simple pattern matching.
 """
 
+from __future__ import annotations
+
 import json
-import subprocess
 import sys
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
+from functools import lru_cache
 from pathlib import Path
-from typing import Any
+from typing import TYPE_CHECKING, Any
+
+# BEHAVIOR: The hook runs as a fresh process per tool call, and most calls are
+# settled by the code checks. Modules only needed to query the LLM are imported
+# where they are used, keeping them off the startup path.
+if TYPE_CHECKING:
+    import sqlite3
+    import subprocess
+    import threading
 
 # Configuration
 CLAUDE_MODEL = "haiku"
 TIMEOUT_SECONDS = 60  # Allow time for Claude CLI
+CACHE_VERSION = 1  # Bump when prompts or verdict handling change, to drop cached verdicts
+CACHE_TTL_SECONDS = 7 * 24 * 60 * 60  # "haiku" is an alias, so re-ask after model updates
+NO_CACHE_ENV = "PROMPT_ME_LESS_NO_CACHE"  # Set to 1 to always ask the LLM
 
 # Tools that are always safe (read-only by design)
 ALWAYS_SAFE_TOOLS = {"Read", "Glob", "Grep", "WebSearch", "WebFetch"}
@@ -27,7 +42,6 @@ ALWAYS_SAFE_TOOLS = {"Read", "Glob", "Grep", "WebSearch", "WebFetch"}
 ALWAYS_ASK_TOOLS = {"Task", "Skill"}
 
 # Settings file paths
-GLOBAL_SETTINGS = Path.home() / ".claude" / "settings.local.json"
 PROJECT_SETTINGS_NAME = ".claude/settings.local.json"
 
 # BEHAVIOR: Code-based safety net - catches dangerous patterns before LLM
@@ -47,7 +61,8 @@ UNSAFE_COMMANDS = {
     "sk-", "api_key=", "apikey=", "API_KEY=",
     "token=", "TOKEN=", "secret=", "SECRET=",
     "password=", "PASSWORD=", "passwd=",
-    "Bearer ", "Basic ",
+    # Auth headers are matched case-insensitively, like every pattern here
+    "bearer ", "basic ",
     # System modification
     "sudo ", "sudo\t", "doas ",
     "chmod ", "chown ", "chgrp ",
@@ -91,6 +106,7 @@ SAFE_COMMAND_BASES = {
     "find ", "grep ", "wc ", "du ", "df ",
 }
 
+
 SYSTEM_PROMPT = """Evaluate if this bash command is safe to run without user confirmation.
 
 Evaluate the EXACT command received. Is THIS specific command safe?
@@ -131,6 +147,20 @@ or
 """
 
 
+def classify_command(command: str) -> tuple[bool, bool, bool]:
+    """Run all code-based checks at once. Returns (unsafe, known_safe, never_whitelist).
+
+    For callers that need every answer (the test runner). The hook needs only some
+    of them per command, so it calls the short-circuiting check_* functions.
+    """
+    cmd_lower = command.lower()
+    return (
+        any(pattern in cmd_lower for pattern in UNSAFE_COMMANDS),
+        any(pattern in cmd_lower for pattern in SAFE_COMMAND_BASES),
+        any(pattern in cmd_lower for pattern in NEVER_WHITELIST_COMMANDS),
+    )
+
+
 def check_unsafe_command(command: str) -> bool:
     """Code-based check: Is this command unsafe to run? (100% reliable)"""
     cmd_lower = command.lower()
@@ -149,12 +179,24 @@ def check_safe_command(command: str) -> bool:
     return any(pattern in cmd_lower for pattern in SAFE_COMMAND_BASES)
 
 
+@lru_cache(maxsize=None)
+def global_settings_path() -> Path:
+    """Global settings file (~/.claude/settings.local.json)."""
+    return Path.home() / ".claude" / "settings.local.json"
+
+
+@lru_cache(maxsize=None)
+def cache_path() -> Path:
+    """Local cache of parsed LLM responses, shared across hook runs."""
+    return Path.home() / ".claude" / "validate_cache.sqlite3"
+
+
 def get_settings_path() -> Path:
     """Get the closest settings file (project-level if exists, else global)."""
     project_settings = Path.cwd() / PROJECT_SETTINGS_NAME
     if project_settings.exists():
         return project_settings
-    return GLOBAL_SETTINGS
+    return global_settings_path()
 
 
 def is_command_whitelisted(command: str) -> bool:
@@ -223,33 +265,298 @@ def add_to_whitelist(command: str, pattern: str) -> None:
         settings_path.write_text(json.dumps(settings, indent=2) + "\n")
 
 
-def query_claude(prompt: str, system_prompt: str) -> dict[str, Any] | None:
-    """Query Claude Haiku via Claude Code CLI for safety assessment."""
-    full_prompt = f"{system_prompt}\n\n{prompt}"
+def cache_key(system_prompt: str, prompt: str) -> str:
+    """Key for a cached LLM response to (system_prompt, prompt)."""
+    import hashlib
+
+    data = f"{CACHE_VERSION}\0{CLAUDE_MODEL}\0{system_prompt}\0{prompt}".encode()
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+@contextmanager
+def open_cache() -> Iterator[sqlite3.Connection | None]:
+    """Connection to the local response cache, or None if it can't be opened.
+
+    Open it once per call site and pass it to cache_get/cache_put. Setting
+    NO_CACHE_ENV disables the cache.
+    """
+    import os
+    import sqlite3
+
+    if os.environ.get(NO_CACHE_ENV):
+        yield None
+        return
+
+    conn = None
     try:
-        result = subprocess.run(
-            ["claude", "-p", full_prompt, "--model", CLAUDE_MODEL, "--output-format", "json"],
-            capture_output=True,
-            text=True,
-            timeout=TIMEOUT_SECONDS,
+        path = cache_path()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(path, timeout=5)
+        # WAL lets concurrent hook runs write without blocking readers
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS verdicts"
+            " (key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL)"
         )
-        if result.returncode != 0:
-            return None
-
-        # Parse JSON output - claude outputs JSON with "result" field containing the response
-        output = json.loads(result.stdout)
-        response_text = output.get("result", "")
-
-        # Extract JSON from response text
-        start = response_text.find("{")
-        end = response_text.rfind("}") + 1
-        if start != -1 and end > start:
-            return json.loads(response_text[start:end])
+    except (sqlite3.Error, OSError):
+        # Cache is best-effort - run without it
+        if conn is not None:
+            conn.close()
+            conn = None
+    try:
+        yield conn
+    finally:
+        if conn is not None:
+            conn.close()
+
+
+def cache_get(conn: sqlite3.Connection | None, key: str) -> Any | None:
+    """Get a cached LLM response, or None if missing or older than CACHE_TTL_SECONDS."""
+    import sqlite3
+    import time
+
+    if conn is None:
+        return None
+    try:
+        row = conn.execute(
+            "SELECT value FROM verdicts WHERE key = ? AND created > ?",
+            (key, time.time() - CACHE_TTL_SECONDS),
+        ).fetchone()
+    except sqlite3.Error:
+        return None
+    return json.loads(row[0]) if row else None
+
+
+def cache_put(conn: sqlite3.Connection | None, key: str, value: Any) -> None:
+    """Store an LLM response in the local cache."""
+    import sqlite3
+    import time
+
+    if conn is None:
+        return
+    try:
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO verdicts (key, value, created) VALUES (?, ?, ?)",
+                (key, json.dumps(value), time.time()),
+            )
+    except sqlite3.Error:
+        pass  # Cache is best-effort
+
+
+def is_valid_result(result: Any) -> bool:
+    """Whether an LLM result for one command is usable (and so worth caching)."""
+    return isinstance(result, dict) and isinstance(result.get("safe"), bool)
+
+
+def read_result_event(lines: Iterable[str | bytes]) -> dict[str, Any] | None:
+    """Read stream-json events until the final "result" event (None if the stream ends first)."""
+    for line in lines:
+        if not line.strip():
+            continue  # Blank keep-alive lines aren't events
+        event = json.loads(line)
+        if event.get("type") == "result":
+            return event
+    return None
+
+
+def result_text(event: dict[str, Any] | None) -> str | None:
+    """Response text of a "result" event, or None if missing or an error."""
+    if event is None or event.get("is_error"):
+        return None
+    return event.get("result", "")
+
+
+@contextmanager
+def kill_on_timeout(proc: subprocess.Popen[str]) -> Iterator[threading.Event]:
+    """Kill proc if the block runs past TIMEOUT_SECONDS; the yielded event records it."""
+    import threading
+
+    timed_out = threading.Event()
+
+    def expire() -> None:
+        timed_out.set()
+        proc.kill()
+
+    timer = threading.Timer(TIMEOUT_SECONDS, expire)
+    timer.start()
+    try:
+        yield timed_out
+    finally:
+        timer.cancel()
+
+
+def claude_once_args(prompt: str, system_prompt: str) -> list[str]:
+    """Command line for a one-shot Claude CLI query."""
+    return [
+        "claude", "-p", prompt, "--model", CLAUDE_MODEL,
+        "--system-prompt", system_prompt, "--output-format", "stream-json", "--verbose",
+    ]
+
+
+def query_claude_once(prompt: str, system_prompt: str) -> str | None:
+    """Run a one-shot Claude CLI process and return the response text.
+
+    Output is streamed, so the answer is used as soon as the "result" event
+    arrives rather than after the CLI finishes shutting down.
+    """
+    import subprocess
+
+    proc = subprocess.Popen(
+        claude_once_args(prompt, system_prompt),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+    )
+    try:
+        with kill_on_timeout(proc) as timed_out:
+            event = read_result_event(proc.stdout)
+    finally:
+        # Done with the process either way - don't wait for its shutdown
+        proc.kill()
+        proc.wait()
+        proc.stdout.close()
+
+    if event is None and timed_out.is_set():
+        raise subprocess.TimeoutExpired(proc.args, TIMEOUT_SECONDS)
+    return result_text(event)
+
+
+def parse_response(response_text: str | None) -> dict[str, Any] | None:
+    """Extract the JSON object from an LLM response."""
+    if not response_text:
+        return None
+
+    # Extract JSON from response text
+    start = response_text.find("{")
+    end = response_text.rfind("}") + 1
+    if start != -1 and end > start:
+        return json.loads(response_text[start:end])
+    return None
+
+
+def ask_claude(prompt: str, system_prompt: str) -> dict[str, Any] | None:
+    """Query Claude once, bypassing the cache. Failures are logged and return None."""
+    import subprocess
+
+    try:
+        return parse_response(query_claude_once(prompt, system_prompt))
     except (subprocess.TimeoutExpired, json.JSONDecodeError, FileNotFoundError) as e:
         print(f"Claude query failed: {e}", file=sys.stderr)
     return None
 
 
+def query_claude(
+    prompt: str, system_prompt: str, cache_text: str | None = None
+) -> dict[str, Any] | None:
+    """Query Claude Haiku via Claude Code CLI for safety assessment.
+
+    The static system prompt is sent as the session's system prompt (a stable,
+    cacheable prefix) and only the per-call prompt as the user message. The
+    verdict is cached under cache_text (default: the prompt).
+    """
+    key = cache_key(system_prompt, prompt if cache_text is None else cache_text)
+    with open_cache() as cache:
+        # BEHAVIOR: Repeated queries are answered from the local cache, skipping the LLM
+        cached = cache_get(cache, key)
+        if cached is not None:
+            return cached
+
+        result = ask_claude(prompt, system_prompt)
+        # Only usable verdicts are cached; anything else is asked again next time
+        if is_valid_result(result):
+            cache_put(cache, key, result)
+        return result
+
+
+def query_claude_many(
+    prompts: list[str], system_prompt: str, max_parallel: int = 16
+) -> list[dict[str, Any] | None]:
+    """Query Claude for several prompts concurrently, from a single thread.
+
+    Each prompt gets a one-shot CLI process (at most max_parallel at a time),
+    and their stdout pipes are multiplexed with a selector - no threads or event
+    loop child watchers needed. Responses are not cached here; callers cache the
+    per-command results they validate.
+
+    Windows selectors can't wait on pipes, so there each query runs on its own
+    thread instead.
+    """
+    if sys.platform == "win32":
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=max(1, min(len(prompts), max_parallel))) as executor:
+            return list(executor.map(lambda prompt: ask_claude(prompt, system_prompt), prompts))
+
+    import os
+    import selectors
+    import subprocess
+    import time
+
+    results: list[dict[str, Any] | None] = [None] * len(prompts)
+    pending = list(reversed(range(len(prompts))))
+
+    selector = selectors.DefaultSelector()
+
+    def start(i: int) -> None:
+        try:
+            proc = subprocess.Popen(
+                claude_once_args(prompts[i], system_prompt),
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+            )
+        except FileNotFoundError as e:
+            print(f"Claude query failed: {e}", file=sys.stderr)
+            return
+        # Per-process state: prompt index, process, partial line, deadline
+        state = (i, proc, bytearray(), time.monotonic() + TIMEOUT_SECONDS)
+        selector.register(proc.stdout, selectors.EVENT_READ, state)
+
+    def finish(key: selectors.SelectorKey) -> None:
+        # Done with the process either way - don't wait for its shutdown
+        selector.unregister(key.fileobj)
+        proc = key.data[1]
+        proc.kill()
+        proc.wait()
+        proc.stdout.close()
+
+    try:
+        while pending or selector.get_map():
+            while pending and len(selector.get_map()) < max_parallel:
+                start(pending.pop())
+            if not selector.get_map():
+                continue
+
+            next_deadline = min(key.data[3] for key in selector.get_map().values())
+            for key, _ in selector.select(max(0.0, next_deadline - time.monotonic())):
+                i, _, buffer, _ = key.data
+                chunk = os.read(key.fd, 65536)
+                buffer += chunk
+                # Complete stream-json lines; keep a trailing partial line for the next read
+                lines = buffer.split(b"\n")
+                buffer[:] = b"" if not chunk else lines.pop()
+                try:
+                    event = read_result_event(lines)
+                    if event is not None or not chunk:
+                        results[i] = parse_response(result_text(event))
+                        finish(key)
+                except json.JSONDecodeError as e:
+                    print(f"Claude query failed: {e}", file=sys.stderr)
+                    finish(key)
+
+            now = time.monotonic()
+            for key in list(selector.get_map().values()):
+                if now >= key.data[3]:
+                    print(f"Claude query failed: timed out after {TIMEOUT_SECONDS} seconds", file=sys.stderr)
+                    finish(key)
+    finally:
+        for key in list(selector.get_map().values()):
+            finish(key)
+        selector.close()
+
+    return results
+
+
 def format_tool_for_analysis(tool_name: str, tool_input: dict[str, Any]) -> str:
     """Format tool call for LLM analysis."""
     if tool_name == "Bash":
@@ -330,7 +637,10 @@ def main() -> None:
 
     # For commands not caught by code checks, use LLM
     analysis_prompt = format_tool_for_analysis(tool_name, tool_input)
-    llm_result = query_claude(analysis_prompt, SYSTEM_PROMPT)
+    # BEHAVIOR: Bash verdicts are cached per command. The agent's free-text
+    # description differs between calls and must not change the verdict.
+    cache_text = tool_input.get("command", "") if tool_name == "Bash" else None
+    llm_result = query_claude(analysis_prompt, SYSTEM_PROMPT, cache_text)
 
     if llm_result is None:
         # BEHAVIOR: If LLM unavailable, let Claude Code decide (respects whitelist)